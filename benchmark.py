@@ -0,0 +1,186 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+from file_utils import generate_manifest
+from server_backend import FileServer
+from client_backend import FileClient
+from verify_logic import MockConfig
+import network_protocol as protocol
+
+# Synthetic trees: name -> (builder, description). Sizes are multiplied by --scale.
+def build_small_files(folder, rng, scale):
+    count = max(1, int(5000 * scale))
+    for i in range(count):
+        sub = os.path.join(folder, f"cfg{i % 50:02d}")
+        os.makedirs(sub, exist_ok=True)
+        with open(os.path.join(sub, f"file{i:06d}.cfg"), "wb") as f:
+            f.write(rng.randbytes(rng.randint(256, 4096)))
+
+def build_huge_files(folder, rng, scale):
+    size = max(1, int(64 * 1024 * 1024 * scale))
+    for i in range(3):
+        with open(os.path.join(folder, f"release{i}.bin"), "wb") as f:
+            remaining = size
+            while remaining > 0:
+                block = min(remaining, 1024 * 1024)
+                f.write(rng.randbytes(block))
+                remaining -= block
+
+def build_deep_dirs(folder, rng, scale):
+    depth = max(1, int(40 * scale))
+    path = folder
+    for level in range(depth):
+        path = os.path.join(path, f"level{level:02d}")
+        os.makedirs(path, exist_ok=True)
+        for i in range(20):
+            with open(os.path.join(path, f"item{i:02d}.dat"), "wb") as f:
+                f.write(rng.randbytes(rng.randint(1024, 16384)))
+
+TREES = {
+    "small_files": build_small_files,
+    "huge_files": build_huge_files,
+    "deep_dirs": build_deep_dirs,
+}
+
+def tree_stats(folder):
+    files = 0
+    total = 0
+    for root, _, names in os.walk(folder):
+        for name in names:
+            files += 1
+            total += os.path.getsize(os.path.join(root, name))
+    return files, total
+
+def rates(seconds, files, total_bytes):
+    return {
+        "seconds": round(seconds, 4),
+        "files": files,
+        "bytes": total_bytes,
+        "files_per_s": round(files / seconds, 1) if seconds else None,
+        "mb_per_s": round(total_bytes / seconds / (1024 * 1024), 2) if seconds else None,
+    }
+
+def bench_manifest(folder):
+    files, total = tree_stats(folder)
+    start = time.perf_counter()
+    generate_manifest(folder)
+    return rates(time.perf_counter() - start, files, total)
+
+def bench_protocol(frames, payload_size):
+    """Pushes FDATA-style frames through a local socket pair and measures the receive side."""
+    sender, receiver = socket.socketpair()
+    payload = os.urandom(payload_size).decode('latin1')
+
+    def send_frames():
+        for _ in range(frames):
+            protocol.send_message(sender, protocol.CMD_FILE_DATA, payload)
+        protocol.send_message(sender, protocol.CMD_FILE_END)
+
+    start = time.perf_counter()
+    thread = threading.Thread(target=send_frames)
+    thread.start()
+    received = 0
+    while True:
+        cmd, _ = protocol.receive_message(receiver)
+        if cmd != protocol.CMD_FILE_DATA:
+            break
+        received += 1
+    thread.join()
+    seconds = time.perf_counter() - start
+    sender.close()
+    receiver.close()
+
+    return {
+        "seconds": round(seconds, 4),
+        "frames": received,
+        "payload_size": payload_size,
+        "frames_per_s": round(received / seconds, 1),
+        "mb_per_s": round(received * payload_size / seconds / (1024 * 1024), 2),
+    }
+
+def bench_sync(server_dir, client_dir, port):
+    server = FileServer(MockConfig({"server_ip": "127.0.0.1", "server_port": port, "shared_folder": server_dir}))
+    server.start_server()
+    if not server.running:
+        raise RuntimeError(f"Could not start benchmark server on port {port}")
+
+    client = FileClient(MockConfig({"server_ip": "127.0.0.1", "server_port": port, "shared_folder": client_dir}))
+    errors = []
+    client.log_message.connect(lambda msg: errors.append(msg) if "error" in msg.lower() else None)
+    try:
+        files, total = tree_stats(server_dir)
+        start = time.perf_counter()
+        client.running = True
+        client._sync_process()
+        seconds = time.perf_counter() - start
+    finally:
+        server.stop_server()
+        server.thread.join()
+
+    synced_files, synced_bytes = tree_stats(client_dir)
+    if (synced_files, synced_bytes) != (files, total) or errors:
+        raise RuntimeError(f"Sync of {server_dir} incomplete: {errors}")
+    return rates(seconds, files, total)
+
+def run(args):
+    from PySide6.QtCore import QCoreApplication
+    app = QCoreApplication.instance() or QCoreApplication([])
+
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": args.scale,
+        "seed": args.seed,
+        "protocol": {
+            "control_frames": bench_protocol(args.frames, 64),
+            "data_frames": bench_protocol(args.frames, 8192),
+        },
+        "trees": {},
+    }
+
+    work_dir = tempfile.mkdtemp(prefix="sum_bench_")
+    try:
+        for offset, name in enumerate(args.trees):
+            server_dir = os.path.join(work_dir, name, "server")
+            client_dir = os.path.join(work_dir, name, "client")
+            os.makedirs(server_dir)
+            TREES[name](server_dir, random.Random(args.seed), args.scale)
+            print(f"Benchmarking {name}...", file=sys.stderr)
+            results["trees"][name] = {
+                "manifest": bench_manifest(server_dir),
+                "sync": bench_sync(server_dir, client_dir, args.port + offset),
+            }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark manifest generation, protocol framing and loopback sync.")
+    parser.add_argument("--trees", nargs="+", choices=sorted(TREES), default=list(TREES),
+                        help="Synthetic trees to generate (default: all)")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="Multiplier for file counts and sizes, e.g. 0.1 for a quick run")
+    parser.add_argument("--frames", type=int, default=20000, help="Frames per protocol benchmark")
+    parser.add_argument("--seed", type=int, default=1234, help="Seed for the synthetic file contents")
+    parser.add_argument("--port", type=int, default=5100, help="First loopback port for the sync benchmarks")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    report = json.dumps(run(args), indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,12 @@
 import os
+import time
+import selectors
 import socket
 import threading
 from PySide6.QtCore import QObject, Signal
 from config_manager import ConfigManager
-from file_utils import generate_manifest
+from file_utils import generate_manifest, build_manifest_index, matches_any
+from file_writer import FileWriter, fsync_files
 import network_protocol as protocol
 
 class FileClient(QObject):
@@ -18,15 +21,55 @@ class FileClient(QObject):
         self.socket = None
         self.running = False
         self.thread = None
+        self.session_mode = False
+        self._sync_requested = False
+        self._last_seen = 0
+        self._unsynced_files = []
+        self._local_manifest = None
+        # Optional commands the connected server advertised in its HELLO reply
+        self._capabilities = []
 
     def start_sync(self):
         if self.running:
+            if self.session_mode:
+                # The session thread owns the socket; ask it to sync on its next turn
+                self._sync_requested = True
+            return
+
+        if not self._wait_for_previous():
             return
-        
         self.running = True
         self.thread = threading.Thread(target=self._sync_process)
         self.thread.start()
 
+    def start_session(self):
+        """
+        Keeps one connection open, syncing on connect and whenever the server reports changes.
+        Returns False if the session could not be started.
+        """
+        if self.running:
+            if not self.session_mode:
+                self.log_message.emit("A sync is already running; enable auto-sync once it finishes.")
+                return False
+            return True
+
+        if not self._wait_for_previous():
+            return False
+        self.running = True
+        self.session_mode = True
+        self.thread = threading.Thread(target=self._session_loop)
+        self.thread.start()
+        return True
+
+    def _wait_for_previous(self):
+        """Lets a thread that is being stopped wind down, so two runs never share the socket."""
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=3)
+            if self.thread.is_alive():
+                self.log_message.emit("The previous sync is still stopping, try again in a moment.")
+                return False
+        return True
+
     def stop_sync(self):
         self.running = False
         if self.socket:
@@ -35,94 +78,391 @@ class FileClient(QObject):
             except:
                 pass
 
-    def _sync_process(self):
+    def _connect(self):
         ip = self.config.get("server_ip")
         port = self.config.get("server_port")
+
+        self.log_message.emit(f"Connecting to {ip}:{port}...")
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Bounds every reply wait, e.g. an older server that ignores a command it does not know
+        self.socket.settimeout(self.config.get("request_timeout"))
+        self.socket.connect((ip, port))
+        self.connection_status.emit(True)
+        self.log_message.emit("Connected.")
+
+        # Handshake
+        protocol.send_message(self.socket, protocol.CMD_HELLO)
+        cmd, data = self._receive()
+        if cmd != protocol.CMD_HELLO:
+            self.log_message.emit("Handshake failed.")
+            return False
+        self._capabilities = data.get("capabilities", []) if isinstance(data, dict) else []
+        return True
+
+    def _receive(self):
+        """Receives the next reply, absorbing session traffic (PONG/NOTIFY) that arrives in between."""
+        while True:
+            cmd, data = protocol.receive_message(self.socket)
+            if cmd is not None:
+                self._last_seen = time.monotonic()
+            if cmd == protocol.CMD_NOTIFY:
+                self._sync_requested = True
+            elif cmd != protocol.CMD_PONG:
+                return cmd, data
+
+    def _sync_process(self):
         local_folder = self.config.get("shared_folder")
 
         if not os.path.exists(local_folder):
             os.makedirs(local_folder)
 
         try:
-            self.log_message.emit(f"Connecting to {ip}:{port}...")
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.connect((ip, port))
-            self.connection_status.emit(True)
-            self.log_message.emit("Connected.")
-
-            # Handshake
-            protocol.send_message(self.socket, protocol.CMD_HELLO)
-            cmd, data = protocol.receive_message(self.socket)
-            if cmd != protocol.CMD_HELLO:
-                self.log_message.emit("Handshake failed.")
+            if not self._connect():
                 return
+            self._sync_with_server(local_folder)
+        except Exception as e:
+            self.log_message.emit(f"Sync error: {e}")
+        finally:
+            self.connection_status.emit(False)
+            if self.socket:
+                self.socket.close()
+            self.running = False
 
-            # Request Manifest
-            self.log_message.emit("Requesting file list...")
-            protocol.send_message(self.socket, protocol.CMD_LIST)
-            cmd, server_manifest = protocol.receive_message(self.socket)
-            
-            if cmd != protocol.CMD_LIST:
-                self.log_message.emit("Failed to get file list.")
-                return
+    def _session_loop(self):
+        local_folder = self.config.get("shared_folder")
+        heartbeat = self.config.get("heartbeat_interval")
+        max_delay = self.config.get("reconnect_max_delay")
+        delay = 1
 
-            # Compare Manifests
-            self.log_message.emit("Comparing files...")
-            local_manifest = generate_manifest(local_folder)
-            files_to_download = []
+        if not os.path.exists(local_folder):
+            os.makedirs(local_folder)
 
-            for rel_path, meta in server_manifest.items():
-                if rel_path not in local_manifest or local_manifest[rel_path]['hash'] != meta['hash']:
-                    files_to_download.append(rel_path)
+        while self.running:
+            try:
+                if self._connect():
+                    if protocol.CMD_SUBSCRIBE not in self._capabilities:
+                        raise ConnectionError("Server does not support change notifications")
+                    protocol.send_message(self.socket, protocol.CMD_SUBSCRIBE)
+                    try:
+                        cmd, data = self._receive()
+                    except socket.timeout:
+                        cmd = None
+                    if cmd != protocol.CMD_SUBSCRIBE:
+                        raise ConnectionError("Server does not support change notifications")
+                    delay = 1
+                    self._sync_requested = True
+                    self._serve_session(local_folder, heartbeat)
+            except Exception as e:
+                if self.running:
+                    self.log_message.emit(f"Connection lost: {e}")
+            finally:
+                self.connection_status.emit(False)
+                if self.socket:
+                    self.socket.close()
 
-            total_files = len(files_to_download)
-            if total_files == 0:
-                self.log_message.emit("Folder is up to date.")
-                self.sync_finished.emit()
-                return
+            if not self.running:
+                break
+            self.log_message.emit(f"Reconnecting in {delay}s...")
+            deadline = time.monotonic() + delay
+            while self.running and time.monotonic() < deadline:
+                time.sleep(0.2)
+            delay = min(delay * 2, max_delay)
 
-            self.log_message.emit(f"Found {total_files} new/modified files.")
-            
-            for i, filename in enumerate(files_to_download):
-                if not self.running:
-                    break
-                
-                self.log_message.emit(f"Downloading {filename}...")
-                self._download_file(filename, local_folder)
-                self.progress_update.emit(i + 1, total_files)
+        self.session_mode = False
+
+    def _serve_session(self, local_folder, heartbeat):
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.socket, selectors.EVENT_READ)
+            self._session_events(selector, local_folder, heartbeat)
+
+    def _session_events(self, selector, local_folder, heartbeat):
+        last_ping = time.monotonic()
+        while self.running:
+            if self._sync_requested:
+                self._sync_requested = False
+                self._sync_with_server(local_folder)
+
+            readable = selector.select(1.0)
+            now = time.monotonic()
+            if readable:
+                cmd, data = protocol.receive_message(self.socket)
+                if cmd is None:
+                    raise ConnectionError("Server closed the connection")
+                self._last_seen = now
+                if cmd == protocol.CMD_NOTIFY:
+                    self.log_message.emit("Server reported new files.")
+                    self._sync_requested = True
+            elif now - self._last_seen > heartbeat * 3:
+                raise ConnectionError("Heartbeat timed out")
+            elif now - last_ping >= heartbeat:
+                protocol.send_message(self.socket, protocol.CMD_PING)
+                last_ping = now
 
-            self.log_message.emit("Sync completed.")
+    def _sync_with_server(self, local_folder):
+        # Unchanged files keep their hash from the previous sync instead of being reread
+        previous_folder, previous = self._local_manifest or (None, None)
+        local_manifest = generate_manifest(local_folder, previous=previous if previous_folder == local_folder else None)
+        self._local_manifest = (local_folder, local_manifest)
+
+        # Compare Manifests
+        self.log_message.emit("Comparing files...")
+        server_manifest = self._diff_with_server(local_manifest)
+        if server_manifest is None:
+            self.log_message.emit("Failed to get file list.")
+            return
+        files_to_download = list(server_manifest)
+
+        total_files = len(files_to_download)
+        if total_files == 0:
+            self.log_message.emit("Folder is up to date.")
             self.sync_finished.emit()
+            return
 
-        except Exception as e:
-            self.log_message.emit(f"Sync error: {e}")
-        finally:
-            self.connection_status.emit(False)
-            if self.socket:
-                self.socket.close()
-            self.running = False
+        self.log_message.emit(f"Found {total_files} new/modified files.")
+
+        files_to_download = self._prioritize(files_to_download, server_manifest)
+        self._unsynced_files = []
+        self._local_manifest = None
+        completed = 0
+        for batch in self._plan_batches(files_to_download, server_manifest):
+            if not self.running:
+                break
+
+            if len(batch) == 1:
+                self.log_message.emit(f"Downloading {batch[0]}...")
+                self._download_file(batch[0], local_folder, server_manifest[batch[0]])
+                completed += 1
+                self.progress_update.emit(completed, total_files)
+                continue
+
+            self.log_message.emit(f"Downloading {len(batch)} small files...")
+            for filename in self._download_bundle(batch, local_folder, server_manifest):
+                completed += 1
+                self.progress_update.emit(completed, total_files)
+
+        if self._unsynced_files:
+            self.log_message.emit(f"Flushing {len(self._unsynced_files)} files to disk...")
+            fsync_files(self._unsynced_files)
+            self._unsynced_files = []
+        self._local_manifest = None
+
+        self.log_message.emit("Sync completed.")
+        self.sync_finished.emit()
+
+    def _diff_with_server(self, local_manifest):
+        """
+        Returns { rel_path: meta } for every server file that is missing or different
+        locally, or None if the server did not answer.
+        """
+        if protocol.CMD_TREE not in self._capabilities:
+            return self._diff_with_list(local_manifest)
+        return self._diff_tree(build_manifest_index(local_manifest))
+
+    def _diff_with_list(self, local_manifest):
+        """Compares against the full server manifest, for servers without TREE."""
+        protocol.send_message(self.socket, protocol.CMD_LIST)
+        cmd, server_manifest = self._receive()
+        if cmd != protocol.CMD_LIST:
+            return None
+
+        changed = {}
+        for rel_path, meta in server_manifest.items():
+            if rel_path not in local_manifest or local_manifest[rel_path]['hash'] != meta['hash']:
+                changed[rel_path] = meta
+        return changed
+
+    def _diff_tree(self, local_index):
+        """
+        Walks the server's manifest index from the root, only descending into directories
+        whose digest differs from the local one.
+        """
+        changed = {}
+        pending = [""]
+        while pending:
+            batch, pending = pending[:protocol.TREE_BATCH_SIZE], pending[protocol.TREE_BATCH_SIZE:]
+            protocol.send_message(self.socket, protocol.CMD_TREE, {"paths": batch})
+            cmd, data = self._receive()
+            if cmd != protocol.CMD_TREE:
+                return None
+
+            for path, node in data["nodes"].items():
+                local = local_index.get(path)
+                if node is None or (local and local["digest"] == node["digest"]):
+                    continue
+                prefix = path + "/" if path else ""
+                for name, digest in node["dirs"].items():
+                    if not local or local["dirs"].get(name) != digest:
+                        pending.append(prefix + name)
+                for name, meta in node["files"].items():
+                    local_meta = local["files"].get(name) if local else None
+                    if not local_meta or local_meta['hash'] != meta['hash']:
+                        changed[prefix + name] = meta
+        return changed
+
+    def _prioritize(self, files_to_download, server_manifest):
+        """
+        Orders the download queue: files matching earlier priority_patterns come first,
+        then within each class either manifest order or smallest files first.
+        """
+        patterns = self.config.get("priority_patterns")
+        smallest_first = self.config.get("download_order") == "smallest_first"
+
+        def sort_key(filename):
+            rank = len(patterns)
+            for i, pattern in enumerate(patterns):
+                if matches_any(filename, [pattern]):
+                    rank = i
+                    break
+            size = server_manifest[filename]['size'] if smallest_first else 0
+            return rank, size
+
+        # sorted() is stable, so ties keep the server's manifest order
+        return sorted(files_to_download, key=sort_key)
+
+    def _plan_batches(self, files_to_download, server_manifest):
+        """
+        Groups consecutive small files into bundles so they share one request instead of
+        paying a full GET exchange each. Large files are returned as single-file batches.
+        """
+        if protocol.CMD_GET_BUNDLE not in self._capabilities:
+            return [[filename] for filename in files_to_download]
+
+        # The server refuses bundle entries above BUNDLE_MAX_FILE_SIZE
+        max_size = min(self.config.get("bundle_max_file_kb") * 1024, protocol.BUNDLE_MAX_FILE_SIZE)
+        max_files = self.config.get("bundle_max_files")
+        batches = []
+        bundle = []
+        for filename in files_to_download:
+            if server_manifest[filename]['size'] <= max_size:
+                bundle.append(filename)
+                if len(bundle) >= max_files:
+                    batches.append(bundle)
+                    bundle = []
+                continue
+            if bundle:
+                batches.append(bundle)
+                bundle = []
+            batches.append([filename])
+        if bundle:
+            batches.append(bundle)
+        return batches
+
+    def _open_writer(self, filename, local_folder, meta, size):
+        policy = self.config.get("fsync_policy")
+        return FileWriter(
+            os.path.join(local_folder, filename),
+            size=size,
+            expected_hash=meta.get('hash'),
+            buffer_size=self.config.get("write_buffer_kb") * 1024,
+            preallocate=self.config.get("preallocate"),
+            fsync=policy == "file",
+        )
+
+    def _finish_writer(self, filename, writer):
+        try:
+            verified = writer.finish()
+        except OSError as e:
+            writer.abort()
+            self.log_message.emit(f"Cannot write {filename}: {e}")
+            return
+        if not verified:
+            self.log_message.emit(f"Checksum mismatch for {filename}, discarded.")
+            return
+        if self.config.get("fsync_policy") == "end":
+            self._unsynced_files.append(writer.path)
+
+    def _download_bundle(self, filenames, local_folder, server_manifest):
+        """
+        Requests several files at once and yields each filename as soon as it is written.
+        Files the server could not bundle (e.g. grown past the size limit) are retried with GET.
+        """
+        protocol.send_message(self.socket, protocol.CMD_GET_BUNDLE, {"filenames": filenames})
 
-    def _download_file(self, filename, local_folder):
+        pending = dict.fromkeys(filenames)
+        retry = []
+        reader = protocol.BundleReader()
+        while True:
+            cmd, data = self._receive()
+            if cmd == protocol.CMD_BUNDLE_DATA:
+                for header, body in reader.feed(data.encode('latin1')):
+                    filename = header.get("filename")
+                    if filename not in pending:
+                        continue
+                    del pending[filename]
+                    if "error" in header:
+                        self.log_message.emit(f"Server error for {filename}: {header['error']}, retrying with GET")
+                        retry.append(filename)
+                        continue
+                    try:
+                        writer = self._open_writer(filename, local_folder, server_manifest[filename], len(body))
+                        writer.write(body)
+                    except OSError as e:
+                        self.log_message.emit(f"Cannot write {filename}: {e}")
+                    else:
+                        self._finish_writer(filename, writer)
+                    yield filename
+            elif cmd == protocol.CMD_BUNDLE_END:
+                break
+            elif cmd == protocol.CMD_ERROR:
+                # Whole bundle refused (e.g. a server without GETB): fetch the rest one by one
+                self.log_message.emit(f"Server error: {data}")
+                retry.extend(pending)
+                break
+            elif cmd is None:
+                raise ConnectionError("Server closed the connection during a bundle")
+            else:
+                # The stream is out of step; carrying on would misread every later reply
+                raise ConnectionError(f"Unexpected {cmd} reply during a bundle")
+
+        for filename in retry:
+            if not self.running:
+                return
+            self.log_message.emit(f"Downloading {filename}...")
+            self._download_file(filename, local_folder, server_manifest[filename])
+            yield filename
+
+    def _download_file(self, filename, local_folder, meta):
         protocol.send_message(self.socket, protocol.CMD_GET, {"filename": filename})
-        
+
         # Wait for FSTART
-        cmd, data = protocol.receive_message(self.socket)
+        cmd, data = self._receive()
         if cmd != protocol.CMD_FILE_START:
             self.log_message.emit(f"Error starting download for {filename}")
             return
 
-        full_path = os.path.join(local_folder, filename)
-        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        try:
+            writer = self._open_writer(filename, local_folder, meta, data.get("size"))
+        except OSError as e:
+            # Keep reading so the connection stays in step, but drop the data
+            self.log_message.emit(f"Cannot write {filename}: {e}")
+            writer = None
 
-        with open(full_path, 'wb') as f:
+        try:
             while True:
-                cmd, data = protocol.receive_message(self.socket)
+                cmd, data = self._receive()
                 if cmd == protocol.CMD_FILE_DATA:
-                    f.write(data.encode('latin1')) # Decode latin1 back to bytes
+                    if writer is None:
+                        continue
+                    try:
+                        writer.write(data.encode('latin1')) # Decode latin1 back to bytes
+                    except OSError as e:
+                        self.log_message.emit(f"Cannot write {filename}: {e}")
+                        writer.abort()
+                        writer = None
                 elif cmd == protocol.CMD_FILE_END:
                     break
                 elif cmd == protocol.CMD_ERROR:
                     self.log_message.emit(f"Server error: {data}")
-                    break
+                    if writer:
+                        writer.abort()
+                    return
                 else:
-                    break
+                    if writer:
+                        writer.abort()
+                    return
+        except Exception:
+            if writer:
+                writer.abort()
+            raise
+        if writer:
+            self._finish_writer(filename, writer)
@@ -8,7 +8,21 @@ DEFAULT_CONFIG = {
     "server_ip": "127.0.0.1",
     "server_port": 5000,
     "shared_folder": os.path.join(os.getcwd(), "shared_downloads"),
-    "mode_configured": False
+    "mode_configured": False,
+    "heartbeat_interval": 15,  # seconds between client keepalive pings
+    "request_timeout": 120,  # seconds the client waits for any reply before giving up
+    "reconnect_max_delay": 60,  # upper bound for the client reconnect backoff
+    "watch_interval": 5,  # seconds between server scans for changed files
+    "server_cache_mb": 256,  # RAM budget for hot files served to many clients, 0 disables
+    "bundle_max_file_kb": 64,  # files up to this size are downloaded in bundles
+    "bundle_max_files": 1000,  # files per bundle request
+    "sync_include": [],  # server: glob patterns to share, empty shares everything
+    "sync_exclude": [],  # server: glob patterns (files or whole directories) never shared
+    "download_order": "manifest",  # client: "manifest" or "smallest_first"
+    "priority_patterns": [],  # client: globs downloaded first, in the order listed
+    "write_buffer_kb": 1024,  # client: downloaded data is written in blocks of this size
+    "preallocate": True,  # client: reserve the full file size before writing
+    "fsync_policy": "none"  # client: "none", "file" (after each file) or "end" (once per sync)
 }
 
 class ConfigManager:
@@ -0,0 +1,87 @@
+import threading
+from collections import OrderedDict
+
+class FileCache:
+    """
+    Thread-safe LRU cache of file contents bounded by a total byte budget.
+    Keys are (relative_path, manifest_hash) so a changed file never hits an old entry.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        # A single file may not take more than a quarter of the budget, so one huge
+        # download cannot flush every hot small file
+        self.max_entry_bytes = max_bytes // 4
+        self.entries = OrderedDict()
+        # key -> Event for fills in progress, so concurrent misses read the file only once
+        self.loading = {}
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def can_cache(self, size):
+        return 0 < size <= self.max_entry_bytes
+
+    def get(self, key):
+        with self.lock:
+            data = self.entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def get_or_load(self, key, loader):
+        """
+        Returns the cached value for key, calling loader() to fill it on a miss. While one
+        thread is loading a key, other threads asking for it wait for that result.
+        loader may return None for "not cacheable", which is passed through uncached.
+        """
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return data
+            pending = self.loading.get(key)
+            if pending is None:
+                pending = self.loading[key] = threading.Event()
+                self.misses += 1
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            pending.wait()
+            data = self.get(key)
+            # The fill failed or was evicted already; load without caching
+            return data if data is not None else loader()
+
+        try:
+            data = loader()
+            if data is not None:
+                self.put(key, data)
+            return data
+        finally:
+            with self.lock:
+                del self.loading[key]
+            pending.set()
+
+    def put(self, key, data):
+        if not self.can_cache(len(data)):
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= len(old)
+            self.entries[key] = data
+            self.current_bytes += len(data)
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.current_bytes -= len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
@@ -1,38 +1,134 @@
 import os
+import fnmatch
 import hashlib
 
-def generate_manifest(folder_path):
+def matches_any(rel_path, patterns):
+    """
+    Checks a relative path against glob patterns. A pattern also matches everything below
+    a matching directory, so 'logs' or 'build/tmp' exclude whole subtrees.
+    """
+    parts = rel_path.split("/")
+    for pattern in patterns:
+        pattern = pattern.replace("\\", "/").rstrip("/")
+        for i in range(len(parts), 0, -1):
+            if fnmatch.fnmatchcase("/".join(parts[:i]), pattern):
+                return True
+    return False
+
+def is_included(rel_path, include=None, exclude=None):
+    """
+    Applies the sync rules: excluded paths are always dropped; when include patterns
+    are given, only matching paths are kept.
+    """
+    if exclude and matches_any(rel_path, exclude):
+        return False
+    if include and not matches_any(rel_path, include):
+        return False
+    return True
+
+def _walk_included(folder_path, include=None, exclude=None):
+    """Yields (rel_path, full_path) for every file passing the rules, skipping excluded directories entirely."""
+    for root, dirs, files in os.walk(folder_path):
+        rel_root = os.path.relpath(root, folder_path).replace("\\", "/")
+        rel_root = "" if rel_root == "." else rel_root + "/"
+        if exclude:
+            # Prune in place so os.walk never descends into excluded subtrees
+            dirs[:] = [d for d in dirs if not matches_any(rel_root + d, exclude)]
+        for file in files:
+            rel_path = rel_root + file
+            if is_included(rel_path, include, exclude):
+                yield rel_path, os.path.join(root, file)
+
+def generate_manifest(folder_path, include=None, exclude=None, previous=None):
     """
     Scans the folder and returns a dictionary of files with their metadata.
     Format: { 'relative/path/to/file': {'hash': 'md5...', 'size': 1234, 'mtime': 123456.7} }
+    Files filtered out by the include/exclude glob patterns are not hashed.
+    Hashes from a previous manifest are reused for files whose size and mtime are unchanged.
     """
     manifest = {}
     if not os.path.exists(folder_path):
         return manifest
 
-    for root, _, files in os.walk(folder_path):
-        for file in files:
-            full_path = os.path.join(root, file)
-            try:
-                rel_path = os.path.relpath(full_path, folder_path).replace("\\", "/")
-                stat = os.stat(full_path)
-                
-                # Calculate hash (MD5 for simplicity/speed in this context)
-                hasher = hashlib.md5()
-                with open(full_path, 'rb') as f:
-                    while chunk := f.read(8192):
-                        hasher.update(chunk)
-                file_hash = hasher.hexdigest()
-
-                manifest[rel_path] = {
-                    'hash': file_hash,
-                    'size': stat.st_size,
-                    'mtime': stat.st_mtime
-                }
-            except OSError:
-                continue # Skip files we can't read
+    for rel_path, full_path in _walk_included(folder_path, include, exclude):
+        try:
+            stat = os.stat(full_path)
+
+            old = previous.get(rel_path) if previous else None
+            if old and old['size'] == stat.st_size and old['mtime'] == stat.st_mtime:
+                manifest[rel_path] = old
+                continue
+
+            # Calculate hash (MD5 for simplicity/speed in this context)
+            hasher = hashlib.md5()
+            with open(full_path, 'rb') as f:
+                while chunk := f.read(8192):
+                    hasher.update(chunk)
+            file_hash = hasher.hexdigest()
+
+            manifest[rel_path] = {
+                'hash': file_hash,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime
+            }
+        except OSError:
+            continue # Skip files we can't read
     return manifest
 
+def build_manifest_index(manifest):
+    """
+    Groups a flat manifest into a Merkle tree keyed by directory ('' is the root).
+    Format: { 'dir/path': {'digest': 'md5...', 'dirs': {'name': 'digest'}, 'files': {'name': meta}} }
+    A directory's digest covers the names and hashes of everything below it, so two
+    trees with equal digests at a node need not be compared any deeper.
+    """
+    index = {"": {"dirs": {}, "files": {}}}
+    for rel_path, meta in manifest.items():
+        parent, _, name = rel_path.rpartition("/")
+        node = index.get(parent)
+        if node is None:
+            # Register the directory chain up to the first one already known
+            node = index[parent] = {"dirs": {}, "files": {}}
+            path = parent
+            while path:
+                up, _, dir_name = path.rpartition("/")
+                known = up in index
+                index.setdefault(up, {"dirs": {}, "files": {}})["dirs"][dir_name] = None
+                if known:
+                    break
+                path = up
+        node["files"][name] = meta
+
+    # Deepest directories first so every child digest is ready before its parent's
+    for path in sorted(index, key=lambda p: p.count("/") + (p != ""), reverse=True):
+        node = index[path]
+        prefix = path + "/" if path else ""
+        hasher = hashlib.md5()
+        for name in sorted(node["dirs"]):
+            digest = index[prefix + name]["digest"]
+            node["dirs"][name] = digest
+            hasher.update(f"d:{name}:{digest}\n".encode('utf-8'))
+        for name in sorted(node["files"]):
+            hasher.update(f"f:{name}:{node['files'][name]['hash']}\n".encode('utf-8'))
+        node["digest"] = hasher.hexdigest()
+    return index
+
+def snapshot_folder(folder_path, include=None, exclude=None):
+    """
+    Cheap change detection: returns { 'relative/path': (size, mtime) } without hashing file contents.
+    """
+    snapshot = {}
+    if not os.path.exists(folder_path):
+        return snapshot
+
+    for rel_path, full_path in _walk_included(folder_path, include, exclude):
+        try:
+            stat = os.stat(full_path)
+            snapshot[rel_path] = (stat.st_size, stat.st_mtime)
+        except OSError:
+            continue
+    return snapshot
+
 def is_safe_path(base_path, target_path):
     """
     Checks if the target_path is safely within the base_path to prevent traversal attacks.
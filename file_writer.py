@@ -0,0 +1,114 @@
+import os
+import uuid
+import errno
+import hashlib
+
+class FileWriter:
+    """
+    Writes one downloaded file: preallocates it to the expected size, aggregates small
+    chunks into large writes and hashes the data on the way in so no second read is needed.
+    The data goes to a hidden temporary file next to path, which replaces path only once
+    verified, so a failed download never destroys the previous good copy.
+    """
+    def __init__(self, path, size=None, expected_hash=None, buffer_size=1024 * 1024,
+                 preallocate=True, fsync=False):
+        self.path = path
+        self.expected_hash = expected_hash
+        self.buffer_size = buffer_size
+        self.fsync = fsync
+        self.hasher = hashlib.md5()
+        self.buffer = bytearray()
+        self.written = 0
+
+        folder, name = os.path.split(path)
+        os.makedirs(folder, exist_ok=True)
+        # Same directory, so the final os.replace() is an atomic rename on one filesystem
+        self.temp_path = os.path.join(folder, f".{name}.{uuid.uuid4().hex[:8]}.part")
+        # Unbuffered: self.buffer already batches the writes
+        self.file = open(self.temp_path, 'xb', buffering=0)
+        if preallocate and size and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(self.file.fileno(), 0, size)
+            except OSError as e:
+                # Filesystems without fallocate just grow the file; anything else (ENOSPC) is fatal
+                if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+                    self.abort()
+                    raise
+
+    def write(self, data):
+        self.hasher.update(data)
+        self.buffer += data
+        if len(self.buffer) >= self.buffer_size:
+            self._flush()
+
+    def _flush(self):
+        if not self.buffer:
+            return
+        # Raw FileIO.write may write only part of the buffer
+        with memoryview(self.buffer) as view:
+            offset = 0
+            while offset < len(view):
+                offset += self.file.write(view[offset:])
+        self.written += len(self.buffer)
+        self.buffer.clear()
+
+    def finish(self):
+        """
+        Closes the file and, if its contents match the expected hash, moves it into place.
+        Returns False (leaving any previous copy untouched) on a mismatch.
+        """
+        try:
+            self._flush()
+            # Drop preallocated space the server did not fill
+            self.file.truncate(self.written)
+            if self.fsync:
+                os.fsync(self.file.fileno())
+        finally:
+            self.file.close()
+
+        if self.expected_hash and self.hasher.hexdigest() != self.expected_hash:
+            self._remove()
+            return False
+        os.replace(self.temp_path, self.path)
+        if self.fsync:
+            # The rename is only durable once the directory entry is flushed too
+            _fsync_directory(os.path.dirname(self.path))
+        return True
+
+    def abort(self):
+        self.file.close()
+        self._remove()
+
+    def _remove(self):
+        try:
+            os.remove(self.temp_path)
+        except OSError:
+            pass
+
+def fsync_files(paths):
+    """
+    Flushes already written files, and the directories they were renamed into, to stable
+    storage in one pass, e.g. at the end of a sync.
+    """
+    folders = set()
+    for path in paths:
+        folders.add(os.path.dirname(path))
+        try:
+            with open(path, 'rb+') as f:
+                os.fsync(f.fileno())
+        except OSError:
+            continue
+    for folder in folders:
+        _fsync_directory(folder)
+
+def _fsync_directory(folder):
+    try:
+        fd = os.open(folder, os.O_RDONLY)
+    except OSError:
+        return # Directories cannot be opened on Windows, where renames need no directory flush
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -1,5 +1,5 @@
 from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton, 
-                               QLabel, QTextEdit, QProgressBar, QFileDialog)
+                               QLabel, QTextEdit, QProgressBar, QFileDialog, QCheckBox)
 from PySide6.QtCore import Qt, Slot
 
 class ServerWidget(QWidget):
@@ -90,6 +90,9 @@ class ClientWidget(QWidget):
         self.sync_btn = QPushButton("Download / Sync Files")
         layout.addWidget(self.sync_btn)
 
+        self.session_check = QCheckBox("Stay connected and sync automatically")
+        layout.addWidget(self.session_check)
+
         self.progress_bar = QProgressBar()
         self.progress_bar.setValue(0)
         layout.addWidget(self.progress_bar)
@@ -101,6 +104,7 @@ class ClientWidget(QWidget):
 
     def connect_signals(self):
         self.sync_btn.clicked.connect(self.start_sync)
+        self.session_check.toggled.connect(self.toggle_session)
         self.backend.log_message.connect(self.append_log)
         self.backend.connection_status.connect(self.update_connection_status)
         self.backend.progress_update.connect(self.update_progress)
@@ -112,6 +116,16 @@ class ClientWidget(QWidget):
         self.progress_bar.setValue(0)
         self.backend.start_sync()
 
+    @Slot(bool)
+    def toggle_session(self, enabled):
+        if enabled:
+            if not self.backend.start_session():
+                self.session_check.blockSignals(True)
+                self.session_check.setChecked(False)
+                self.session_check.blockSignals(False)
+        else:
+            self.backend.stop_sync()
+
     @Slot(bool)
     def update_connection_status(self, connected):
         if connected:
@@ -134,7 +148,11 @@ class ClientWidget(QWidget):
         self.status_label.setText("Sync Completed")
         self.sync_btn.setEnabled(True)
         self.progress_bar.setValue(100)
-        
+
+        # Background syncs in session mode should not keep popping up the folder
+        if self.backend.session_mode:
+            return
+
         # Open the folder
         folder = self.backend.config.get("shared_folder")
         from PySide6.QtGui import QDesktopServices
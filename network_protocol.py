@@ -9,6 +9,24 @@ CMD_ERROR = "ERROR"
 CMD_FILE_START = "FSTART"
 CMD_FILE_DATA = "FDATA"
 CMD_FILE_END = "FEND"
+CMD_PING = "PING"
+CMD_PONG = "PONG"
+CMD_SUBSCRIBE = "SUB"
+CMD_NOTIFY = "NOTIFY"
+CMD_TREE = "TREE"
+CMD_GET_BUNDLE = "GETB"
+CMD_BUNDLE_DATA = "BDATA"
+CMD_BUNDLE_END = "BEND"
+
+# Bundle streams are cut into frames of this size regardless of file boundaries
+BUNDLE_FRAME_SIZE = 65536
+# Larger files are refused inside a bundle and must be fetched with CMD_GET
+BUNDLE_MAX_FILE_SIZE = 4 * 1024 * 1024
+# Directories requested per TREE round trip while descending the manifest index
+TREE_BATCH_SIZE = 500
+# Optional commands this side supports, advertised in the HELLO reply. Servers that
+# predate this list reply to HELLO with a bare string and only know LIST/GET.
+CAPABILITIES = [CMD_SUBSCRIBE, CMD_TREE, CMD_GET_BUNDLE]
 
 def send_message(socket, command, payload=None):
     """
@@ -54,3 +72,40 @@ def _recv_all(socket, n):
             return None
         data += packet
     return data
+
+def pack_bundle_entry(header, body=b''):
+    """
+    Encodes one bundle entry: [Header length (4 bytes)][Header (JSON UTF-8)][Body (header['size'] bytes)]
+    """
+    header_bytes = json.dumps(header).encode('utf-8')
+    return struct.pack('>I', len(header_bytes)) + header_bytes + body
+
+class BundleReader:
+    """
+    Incrementally unpacks a bundle stream. Feed it the bytes of each BDATA frame and it
+    returns the (header, body) entries completed so far.
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        self.header = None
+
+    def feed(self, data):
+        self.buffer += data
+        entries = []
+        while True:
+            if self.header is None:
+                if len(self.buffer) < 4:
+                    break
+                header_len = struct.unpack('>I', self.buffer[:4])[0]
+                if len(self.buffer) < 4 + header_len:
+                    break
+                self.header = json.loads(self.buffer[4:4 + header_len].decode('utf-8'))
+                del self.buffer[:4 + header_len]
+
+            size = self.header.get("size", 0)
+            if len(self.buffer) < size:
+                break
+            entries.append((self.header, bytes(self.buffer[:size])))
+            del self.buffer[:size]
+            self.header = None
+        return entries
@@ -1,54 +1,200 @@
 import os
+import time
+import selectors
+import hashlib
 import socket
 import threading
 from PySide6.QtCore import QObject, Signal, Slot
 from config_manager import ConfigManager
-from file_utils import generate_manifest, is_safe_path
+from file_utils import generate_manifest, build_manifest_index, snapshot_folder, is_safe_path, is_included
+from file_cache import FileCache
 import network_protocol as protocol
 
 class ClientHandler(threading.Thread):
-    def __init__(self, conn, addr, shared_folder, log_signal):
+    def __init__(self, conn, addr, shared_folder, log_signal, server):
         super().__init__()
+        self.server = server
         self.conn = conn
         self.addr = addr
         self.shared_folder = shared_folder
         self.log_signal = log_signal
         self.running = True
+        self.subscribed = False
+        # Set by the watcher thread; only this handler's own thread writes to the socket,
+        # so a client that stops reading can stall nobody but itself
+        self.notify_pending = False
+
+    def send(self, command, payload=None):
+        protocol.send_message(self.conn, command, payload)
+
+    def request_notify(self):
+        self.notify_pending = True
+
+    def close(self):
+        self.running = False
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
 
     def run(self):
         self.log_signal.emit(f"Client connected: {self.addr}")
+        # select.select() cannot watch descriptors >= FD_SETSIZE, which a busy server reaches
+        selector = selectors.DefaultSelector()
+        # Subscribed sessions ping every heartbeat_interval; one silent for three is dead
+        session_timeout = self.server.config.get("heartbeat_interval") * 3
+        last_seen = time.monotonic()
         try:
+            selector.register(self.conn, selectors.EVENT_READ)
             while self.running:
+                if self.notify_pending:
+                    self.notify_pending = False
+                    self.send(protocol.CMD_NOTIFY)
+
+                if not selector.select(0.5):
+                    if self.subscribed and time.monotonic() - last_seen > session_timeout:
+                        self.log_signal.emit(f"Client {self.addr} stopped responding, closing session")
+                        break
+                    continue
+
                 cmd, data = protocol.receive_message(self.conn)
                 if not cmd:
                     break
                 
                 if cmd == protocol.CMD_HELLO:
-                    protocol.send_message(self.conn, protocol.CMD_HELLO, "Welcome")
+                    self.send(protocol.CMD_HELLO, {"message": "Welcome", "capabilities": protocol.CAPABILITIES})
                 
+                elif cmd == protocol.CMD_PING:
+                    self.send(protocol.CMD_PONG)
+
+                elif cmd == protocol.CMD_SUBSCRIBE:
+                    self.subscribed = True
+                    self.log_signal.emit(f"Client {self.addr} subscribed to change notifications")
+                    self.send(protocol.CMD_SUBSCRIBE)
+
                 elif cmd == protocol.CMD_LIST:
                     self.log_signal.emit(f"Sending manifest to {self.addr}")
-                    manifest = generate_manifest(self.shared_folder)
-                    protocol.send_message(self.conn, protocol.CMD_LIST, manifest)
+                    self.server.refresh_if_changed()
+                    self.send(protocol.CMD_LIST, self.server.manifest)
+
+                elif cmd == protocol.CMD_TREE:
+                    paths = data.get("paths", [])
+                    if "" in paths:
+                        # A root request starts a new comparison, so make sure the scan is current
+                        self.log_signal.emit(f"Sending manifest index to {self.addr}")
+                        self.server.refresh_if_changed()
+                    index = self.server.index
+                    self.send(protocol.CMD_TREE, {"nodes": {path: index.get(path) for path in paths}})
                 
                 elif cmd == protocol.CMD_GET:
                     filename = data.get("filename")
                     self.handle_get_file(filename)
+
+                elif cmd == protocol.CMD_GET_BUNDLE:
+                    self.handle_get_bundle(data.get("filenames", []))
+
+                else:
+                    # Always answer, so a newer client waiting for a reply is not left hanging
+                    self.send(protocol.CMD_ERROR, f"Unknown command: {cmd}")
+
+                # Counted after the reply, so a long transfer does not look like silence
+                last_seen = time.monotonic()
                     
         except Exception as e:
             self.log_signal.emit(f"Error with client {self.addr}: {e}")
         finally:
+            selector.close()
             self.conn.close()
             self.log_signal.emit(f"Client disconnected: {self.addr}")
 
     def handle_get_file(self, filename):
         full_path = os.path.join(self.shared_folder, filename)
-        if not is_safe_path(self.shared_folder, full_path) or not os.path.exists(full_path):
-            protocol.send_message(self.conn, protocol.CMD_ERROR, "File not found or access denied")
+        if not self._is_shared(filename, full_path) or not os.path.exists(full_path):
+            self.send(protocol.CMD_ERROR, "File not found or access denied")
             return
 
         self.log_signal.emit(f"Sending file {filename} to {self.addr}")
         file_size = os.path.getsize(full_path)
+        content = self._load_cached(filename, full_path)
+        if content is not None:
+            self._send_cached_file(filename, content)
+        else:
+            self._send_file(filename, full_path, file_size)
+
+    def handle_get_bundle(self, filenames):
+        self.log_signal.emit(f"Sending bundle of {len(filenames)} files to {self.addr}")
+        buffer = bytearray()
+        for filename in filenames:
+            buffer += self._bundle_entry(filename)
+            while len(buffer) >= protocol.BUNDLE_FRAME_SIZE:
+                self._send_bundle_frame(buffer[:protocol.BUNDLE_FRAME_SIZE])
+                del buffer[:protocol.BUNDLE_FRAME_SIZE]
+        if buffer:
+            self._send_bundle_frame(buffer)
+        self.send(protocol.CMD_BUNDLE_END, {"count": len(filenames)})
+
+    def _bundle_entry(self, filename):
+        full_path = os.path.join(self.shared_folder, filename)
+        if not self._is_shared(filename, full_path) or not os.path.isfile(full_path):
+            return protocol.pack_bundle_entry({"filename": filename, "error": "File not found or access denied"})
+
+        try:
+            if os.path.getsize(full_path) > protocol.BUNDLE_MAX_FILE_SIZE:
+                return protocol.pack_bundle_entry({"filename": filename, "error": "File too large for a bundle"})
+            content = self._load_cached(filename, full_path)
+            if content is None:
+                with open(full_path, 'rb') as f:
+                    content = f.read()
+        except OSError as e:
+            return protocol.pack_bundle_entry({"filename": filename, "error": str(e)})
+
+        return protocol.pack_bundle_entry({"filename": filename, "size": len(content)}, content)
+
+    def _is_shared(self, filename, full_path):
+        if not is_safe_path(self.shared_folder, full_path):
+            return False
+        # Match the normalized path, so spellings like './secret/x' cannot dodge an exclude rule
+        rel_path = os.path.relpath(full_path, self.shared_folder).replace("\\", "/")
+        return is_included(rel_path, *self.server.sync_rules())
+
+    def _send_bundle_frame(self, data):
+        self.send(protocol.CMD_BUNDLE_DATA, bytes(data).decode('latin1'))
+
+    def _load_cached(self, filename, full_path):
+        """
+        Returns the file contents from the server cache, reading them into it on a miss.
+        Returns None when the file must be streamed from disk instead.
+        """
+        cache = self.server.file_cache
+        entry = self.server.manifest.get(filename)
+        if cache is None or entry is None or not cache.can_cache(entry['size']):
+            return None
+
+        # The manifest hash only describes the file if it has not been touched since the scan
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            return None
+        if stat.st_size != entry['size'] or stat.st_mtime != entry['mtime']:
+            return None
+
+        def load():
+            with open(full_path, 'rb') as f:
+                content = f.read()
+            if hashlib.md5(content).hexdigest() != entry['hash']:
+                return None # Changed while reading; serve whatever is on disk uncached
+            return content
+
+        return cache.get_or_load((filename, entry['hash']), load)
+
+    def _send_cached_file(self, filename, content):
+        # Frames match _send_file so clients cannot tell the difference
+        self.send(protocol.CMD_FILE_START, {"filename": filename, "size": len(content)})
+        for offset in range(0, len(content), 8192):
+            self.send(protocol.CMD_FILE_DATA, content[offset:offset + 8192].decode('latin1'))
+        self.send(protocol.CMD_FILE_END, {"filename": filename})
+
+    def _send_file(self, filename, full_path, file_size):
         protocol.send_message(self.conn, protocol.CMD_FILE_START, {"filename": filename, "size": file_size})
 
         with open(full_path, 'rb') as f:
@@ -71,6 +217,19 @@ class FileServer(QObject):
         self.server_socket = None
         self.running = False
         self.thread = None
+        self.watch_thread = None
+        self.watch_stop = None
+        self.handlers = []
+        self.handlers_lock = threading.Lock()
+        self.manifest = {}
+        self.index = {}
+        # Rescans run one at a time; scan_generation lets waiting callers reuse the result
+        self.refresh_lock = threading.Lock()
+        self.scan_generation = 0
+        # Folder and stat snapshot the current manifest was built from
+        self.scan_folder = None
+        self.scan_snapshot = None
+        self.file_cache = None
 
     def start_server(self):
         if self.running:
@@ -89,8 +248,19 @@ class FileServer(QObject):
 
         try:
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            if os.name != "nt":
+                # Closed sessions leave TIME_WAIT entries that would block a quick restart
+                self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.server_socket.bind((ip, port))
             self.server_socket.listen(5)
+            # Nothing from a previous run may leak into this one, e.g. a manifest of another folder
+            self.manifest = {}
+            self.index = {}
+            self.scan_generation = 0
+            self.scan_folder = None
+            self.scan_snapshot = None
+            cache_mb = self.config.get("server_cache_mb")
+            self.file_cache = FileCache(cache_mb * 1024 * 1024) if cache_mb else None
             self.running = True
             self.server_status.emit(True)
             self.log_message.emit(f"Server started on {ip}:{port}")
@@ -98,6 +268,10 @@ class FileServer(QObject):
             
             self.thread = threading.Thread(target=self._accept_loop)
             self.thread.start()
+            # A per-run event: a later start cannot un-stop the previous run's watcher
+            self.watch_stop = threading.Event()
+            self.watch_thread = threading.Thread(target=self._watch_loop, args=(self.watch_stop,), daemon=True)
+            self.watch_thread.start()
         except Exception as e:
             self.log_message.emit(f"Failed to start server: {e}")
             self.running = False
@@ -105,7 +279,24 @@ class FileServer(QObject):
     def stop_server(self):
         self.running = False
         if self.server_socket:
+            # close() alone does not wake a blocked accept() on every platform
+            try:
+                self.server_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
             self.server_socket.close()
+        if self.watch_thread:
+            self.watch_stop.set()
+            self.watch_thread.join()
+            self.watch_thread = None
+        # Persistent sessions would otherwise outlive the server
+        with self.handlers_lock:
+            handlers, self.handlers = self.handlers, []
+        for handler in handlers:
+            handler.close()
+        if self.file_cache:
+            self.log_message.emit(f"File cache: {self.file_cache.hits} hits, {self.file_cache.misses} misses")
+            self.file_cache.clear()
         self.server_status.emit(False)
         self.log_message.emit("Server stopped")
 
@@ -113,7 +304,71 @@ class FileServer(QObject):
         while self.running:
             try:
                 conn, addr = self.server_socket.accept()
-                handler = ClientHandler(conn, addr, self.config.get("shared_folder"), self.log_message)
+                handler = ClientHandler(conn, addr, self.config.get("shared_folder"), self.log_message, self)
+                with self.handlers_lock:
+                    self.handlers = [h for h in self.handlers if h.is_alive()]
+                    self.handlers.append(handler)
                 handler.start()
             except OSError:
                 break
+
+    def refresh_manifest(self, snapshot=None):
+        """
+        Rescans the shared folder and publishes the result for cache lookups, LIST and TREE.
+        A caller that had to wait for a scan already in progress reuses that scan.
+        """
+        generation = self.scan_generation
+        with self.refresh_lock:
+            if self.scan_generation != generation:
+                return self.manifest
+
+            folder = self.config.get("shared_folder")
+            include, exclude = self.sync_rules()
+            if snapshot is None:
+                snapshot = snapshot_folder(folder, include, exclude)
+            # Hashes can only be reused from a scan of the same folder
+            previous = self.manifest if folder == self.scan_folder else None
+            manifest = generate_manifest(folder, include, exclude, previous=previous)
+            self.index = build_manifest_index(manifest)
+            self.manifest = manifest
+            self.scan_folder = folder
+            self.scan_snapshot = snapshot
+            self.scan_generation += 1
+            return manifest
+
+    def refresh_if_changed(self):
+        """
+        Rescans only if a cheap stat pass shows the shared folder (or the folder setting)
+        changed since the last scan. Returns True if the manifest is new.
+        """
+        folder = self.config.get("shared_folder")
+        snapshot = snapshot_folder(folder, *self.sync_rules())
+        if self.scan_generation and folder == self.scan_folder and snapshot == self.scan_snapshot:
+            return False
+        self.refresh_manifest(snapshot)
+        return True
+
+    def sync_rules(self):
+        """Returns the (include, exclude) glob patterns limiting what is shared."""
+        return self.config.get("sync_include"), self.config.get("sync_exclude")
+
+    def notify_manifest_changed(self):
+        """Pushes a change notification to every subscribed client so it syncs right away."""
+        with self.handlers_lock:
+            subscribers = [h for h in self.handlers if h.is_alive() and h.subscribed]
+        if subscribers:
+            self.log_message.emit(f"Shared folder changed, notifying {len(subscribers)} client(s)")
+        for handler in subscribers:
+            handler.request_notify()
+
+    def _watch_loop(self, stop_event):
+        interval = self.config.get("watch_interval")
+        self.refresh_if_changed()
+        notified = self.scan_generation
+        while not stop_event.wait(interval):
+            # Reads the folder from config each pass, so "Change Folder" takes effect while online
+            self.refresh_if_changed()
+            # A client request may have rescanned first; subscribers still need to hear about it
+            if self.scan_generation != notified:
+                notified = self.scan_generation
+                self.notify_manifest_changed()
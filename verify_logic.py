@@ -1,10 +1,18 @@
 import os
 import time
+import hashlib
 import shutil
+import socket
+import tempfile
 import threading
-from config_manager import ConfigManager
-from server_backend import FileServer
+from config_manager import ConfigManager, DEFAULT_CONFIG
+from server_backend import FileServer, ClientHandler
 from client_backend import FileClient
+from file_cache import FileCache
+from file_writer import FileWriter
+import file_utils
+from file_utils import generate_manifest, matches_any, is_included
+import network_protocol as protocol
 
 # Mock Config
 class MockConfig(ConfigManager):
@@ -12,7 +20,7 @@ class MockConfig(ConfigManager):
         self.config = data
 
     def get(self, key):
-        return self.config.get(key)
+        return self.config.get(key, DEFAULT_CONFIG.get(key))
     
     def set(self, key, value):
         self.config[key] = value
@@ -44,9 +52,6 @@ def test_sync():
         "shared_folder": client_dir
     })
 
-    from PySide6.QtCore import QCoreApplication
-    app = QCoreApplication([])
-
     print("Starting Server...")
     server = FileServer(server_config)
     server.log_message.connect(lambda msg: print(f"[SERVER] {msg}"))
@@ -84,5 +89,390 @@ def test_sync():
     # shutil.rmtree(server_dir)
     # shutil.rmtree(client_dir)
 
+def start_test_server(folder, port, **extra):
+    config = {"server_ip": "127.0.0.1", "server_port": port, "shared_folder": folder, "watch_interval": 0.5}
+    config.update(extra)
+    server = FileServer(MockConfig(config))
+    server.log_message.connect(lambda msg: print(f"[SERVER] {msg}"))
+    server.start_server()
+    return server
+
+def make_test_client(folder, port, **extra):
+    config = {"server_ip": "127.0.0.1", "server_port": port, "shared_folder": folder}
+    config.update(extra)
+    client = FileClient(MockConfig(config))
+    client.log_message.connect(lambda msg: print(f"[CLIENT] {msg}"))
+    return client
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.1)
+    return False
+
+def test_session():
+    print("Testing persistent session (SUB/NOTIFY/PING)...")
+    base_dir = tempfile.mkdtemp(prefix="sum_session_")
+    server_dir = os.path.join(base_dir, "server")
+    client_dir = os.path.join(base_dir, "client")
+    os.makedirs(server_dir)
+    with open(os.path.join(server_dir, "first.txt"), "w") as f:
+        f.write("first")
+
+    server = start_test_server(server_dir, 5002)
+    client = make_test_client(client_dir, 5002, heartbeat_interval=1)
+    client.start_session()
+    try:
+        if wait_for(lambda: os.path.exists(os.path.join(client_dir, "first.txt"))):
+            print("SUCCESS: Session synced on connect.")
+        else:
+            print("FAILURE: Session did not sync on connect.")
+
+        # Publish a new file; the server should push NOTIFY and the client sync by itself
+        os.makedirs(os.path.join(server_dir, "sub"))
+        with open(os.path.join(server_dir, "sub", "second.txt"), "w") as f:
+            f.write("second")
+        if wait_for(lambda: os.path.exists(os.path.join(client_dir, "sub", "second.txt"))):
+            print("SUCCESS: Client synced after change notification.")
+        else:
+            print("FAILURE: Change notification did not reach the client.")
+
+        # Heartbeats: idle for a few intervals and the session must still be alive
+        time.sleep(3.5)
+        if client.running and client.thread.is_alive():
+            print("SUCCESS: Session survived idle heartbeats.")
+        else:
+            print("FAILURE: Session dropped while idle.")
+
+        conn = socket.create_connection(("127.0.0.1", 5002))
+        protocol.send_message(conn, protocol.CMD_PING)
+        cmd, _ = protocol.receive_message(conn)
+        conn.close()
+        if cmd == protocol.CMD_PONG:
+            print("SUCCESS: Server answered PING.")
+        else:
+            print(f"FAILURE: Expected PONG, got {cmd}.")
+    finally:
+        client.stop_sync()
+        client.thread.join(5)
+        server.stop_server()
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+def test_file_cache():
+    print("Testing server file cache...")
+    cache = FileCache(100)
+    for name in "abcde":
+        cache.put(name, name.encode() * 20)
+    cache.get("a") # Now the most recently used, so "b" is the oldest
+    cache.put("f", b"f" * 20)
+    if cache.get("b") is None and cache.get("a") is not None and cache.current_bytes <= cache.max_bytes:
+        print("SUCCESS: Least recently used entry evicted within the byte budget.")
+    else:
+        print("FAILURE: LRU eviction did not keep the cache within budget.")
+
+    cache.put("huge", b"x" * (cache.max_entry_bytes + 1))
+    if cache.get("huge") is None and cache.get("a") is not None:
+        print("SUCCESS: Entry above max_entry_bytes was not cached.")
+    else:
+        print("FAILURE: Oversized entry was cached.")
+
+    # Concurrent misses for one key must read the file only once
+    loads = []
+    def slow_load():
+        loads.append(1)
+        time.sleep(0.3)
+        return b"shared"
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load("slow", slow_load))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if len(loads) == 1 and results == [b"shared"] * 8:
+        print("SUCCESS: Concurrent misses coalesced into one load.")
+    else:
+        print(f"FAILURE: {len(loads)} loads for 8 concurrent misses.")
+
+    # A file changed since the scan must not be served from (or into) the cache
+    base_dir = tempfile.mkdtemp(prefix="sum_cache_")
+    full_path = os.path.join(base_dir, "hot.txt")
+    with open(full_path, "wb") as f:
+        f.write(b"original")
+    server = FileServer(MockConfig({"shared_folder": base_dir}))
+    server.file_cache = FileCache(1024 * 1024)
+    server.manifest = generate_manifest(base_dir)
+    handler = ClientHandler(None, "test", base_dir, server.log_message, server)
+    first = handler._load_cached("hot.txt", full_path)
+    with open(full_path, "wb") as f:
+        f.write(b"replaced")
+    stat = os.stat(full_path)
+    os.utime(full_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+    if first == b"original" and handler._load_cached("hot.txt", full_path) is None:
+        print("SUCCESS: Stale cache entry bypassed after the file changed.")
+    else:
+        print("FAILURE: Cache served a file that changed since the scan.")
+    shutil.rmtree(base_dir, ignore_errors=True)
+
+def test_bundle_reader():
+    print("Testing bundle stream unpacking across frame splits...")
+    entries = [("a.txt", b"alpha"), ("dir/empty.cfg", b""), ("dir/b.bin", os.urandom(70000))]
+    stream = b"".join(protocol.pack_bundle_entry({"filename": name, "size": len(body)}, body) for name, body in entries)
+    stream += protocol.pack_bundle_entry({"filename": "missing.txt", "error": "File not found or access denied"})
+
+    # Feed in awkward pieces so headers and bodies are split between frames
+    for step in (1, 7, protocol.BUNDLE_FRAME_SIZE):
+        reader = protocol.BundleReader()
+        unpacked = []
+        for offset in range(0, len(stream), step):
+            unpacked.extend(reader.feed(stream[offset:offset + step]))
+        names = [(header["filename"], body) for header, body in unpacked if "error" not in header]
+        errors = [header["filename"] for header, _ in unpacked if "error" in header]
+        if names == entries and errors == ["missing.txt"]:
+            print(f"SUCCESS: Bundle unpacked correctly with {step}-byte frames.")
+        else:
+            print(f"FAILURE: Bundle mismatch with {step}-byte frames.")
+
+def test_bundle_sync():
+    print("Testing bundled download of many small files...")
+    base_dir = tempfile.mkdtemp(prefix="sum_bundle_")
+    server_dir = os.path.join(base_dir, "server")
+    client_dir = os.path.join(base_dir, "client")
+    expected = {}
+    # Well over one bundle frame in total, plus one file too big for a bundle
+    for i in range(60):
+        expected[f"cfg/group{i % 4}/item{i:02d}.cfg"] = os.urandom(3000)
+    expected["cfg/large.bin"] = os.urandom(200 * 1024)
+    for rel_path, body in expected.items():
+        full_path = os.path.join(server_dir, rel_path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "wb") as f:
+            f.write(body)
+
+    server = start_test_server(server_dir, 5003)
+    client = make_test_client(client_dir, 5003)
+    bundles = []
+    client.log_message.connect(lambda msg: bundles.append(msg) if "small files" in msg else None)
+    try:
+        client.running = True
+        client._sync_process()
+    finally:
+        server.stop_server()
+
+    mismatched = []
+    for rel_path, body in expected.items():
+        full_path = os.path.join(client_dir, rel_path)
+        if not os.path.exists(full_path):
+            mismatched.append(rel_path)
+            continue
+        with open(full_path, "rb") as f:
+            if f.read() != body:
+                mismatched.append(rel_path)
+    if not bundles:
+        print("FAILURE: Small files were not bundled.")
+    elif mismatched:
+        print(f"FAILURE: {len(mismatched)} files missing or different, e.g. {mismatched[0]}")
+    else:
+        print(f"SUCCESS: {len(expected)} files synced using {len(bundles)} bundle(s).")
+    shutil.rmtree(base_dir, ignore_errors=True)
+
+def test_sync_rules():
+    print("Testing sync include/exclude rules...")
+    checks = [
+        (matches_any("a.txt", ["a.txt"]), True),
+        (matches_any("logs/a.txt", ["a.txt"]), False),          # Anchored at the root
+        (matches_any("logs/2024/x.log", ["*.log"]), True),      # '*' crosses '/'
+        (matches_any("build/tmp/deep/f.o", ["build/tmp"]), True), # A directory covers its subtree
+        (matches_any("build/other.o", ["build/tmp"]), False),
+        (matches_any("build/tmp/f.o", ["build\\tmp\\"]), True),
+        (is_included("docs/guide.md", ["docs"], ["docs/private"]), True),
+        (is_included("docs/private/key.md", ["docs"], ["docs/private"]), False),
+        (is_included("src/main.py", ["docs"], []), False),
+    ]
+    failed = [i for i, (got, want) in enumerate(checks) if got != want]
+    if not failed:
+        print("SUCCESS: Glob rules matched as documented.")
+    else:
+        print(f"FAILURE: Glob rule checks {failed} did not match.")
+
+    base_dir = tempfile.mkdtemp(prefix="sum_rules_")
+    for rel_path in ("keep/a.txt", "node_modules/pkg/deep/b.js", "keep/node_modules.txt"):
+        full_path = os.path.join(base_dir, rel_path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "w") as f:
+            f.write(rel_path)
+
+    # Record every directory os.walk visits; excluded subtrees must not be entered at all
+    visited = []
+    real_walk = file_utils.os.walk
+    def recording_walk(top, *args, **kwargs):
+        for root, dirs, files in real_walk(top, *args, **kwargs):
+            visited.append(os.path.relpath(root, base_dir).replace("\\", "/"))
+            yield root, dirs, files
+    file_utils.os.walk = recording_walk
+    try:
+        manifest = generate_manifest(base_dir, exclude=["node_modules"])
+    finally:
+        file_utils.os.walk = real_walk
+    if sorted(manifest) == ["keep/a.txt", "keep/node_modules.txt"] and not any(v.startswith("node_modules") for v in visited):
+        print("SUCCESS: Excluded directory pruned from the scan.")
+    else:
+        print(f"FAILURE: Scan visited {visited} and listed {sorted(manifest)}.")
+    shutil.rmtree(base_dir, ignore_errors=True)
+
+    client = make_test_client(base_dir, 0, priority_patterns=["*.cfg"], download_order="smallest_first")
+    server_manifest = {
+        "big.bin": {"size": 500}, "small.bin": {"size": 5},
+        "conf/large.cfg": {"size": 300}, "tiny.cfg": {"size": 1},
+    }
+    order = client._prioritize(list(server_manifest), server_manifest)
+    if order == ["tiny.cfg", "conf/large.cfg", "small.bin", "big.bin"]:
+        print("SUCCESS: Priority patterns first, then smallest files first.")
+    else:
+        print(f"FAILURE: Unexpected download order {order}.")
+
+def test_excluded_requests():
+    print("Testing that excluded files cannot be requested directly...")
+    base_dir = tempfile.mkdtemp(prefix="sum_exclude_")
+    os.makedirs(os.path.join(base_dir, "secret"))
+    with open(os.path.join(base_dir, "secret", "key.pem"), "w") as f:
+        f.write("private")
+    with open(os.path.join(base_dir, "public.txt"), "w") as f:
+        f.write("public")
+
+    server = start_test_server(base_dir, 5005, sync_exclude=["secret"])
+    names = ["secret/key.pem", "./secret/key.pem", "secret//key.pem"]
+    try:
+        conn = socket.create_connection(("127.0.0.1", 5005))
+        replies = []
+        for name in names + ["public.txt"]:
+            protocol.send_message(conn, protocol.CMD_GET, {"filename": name})
+            cmd, _ = protocol.receive_message(conn)
+            while cmd == protocol.CMD_FILE_START or cmd == protocol.CMD_FILE_DATA:
+                replies.append(cmd)
+                cmd, _ = protocol.receive_message(conn)
+            replies.append(cmd)
+        if replies == [protocol.CMD_ERROR] * 3 + [protocol.CMD_FILE_START, protocol.CMD_FILE_DATA, protocol.CMD_FILE_END]:
+            print("SUCCESS: GET refused excluded paths, including './' spellings.")
+        else:
+            print(f"FAILURE: GET replies were {replies}.")
+
+        protocol.send_message(conn, protocol.CMD_GET_BUNDLE, {"filenames": names})
+        reader = protocol.BundleReader()
+        entries = []
+        cmd, data = protocol.receive_message(conn)
+        while cmd == protocol.CMD_BUNDLE_DATA:
+            entries.extend(reader.feed(data.encode('latin1')))
+            cmd, data = protocol.receive_message(conn)
+        conn.close()
+        if len(entries) == len(names) and all("error" in header for header, _ in entries):
+            print("SUCCESS: GETB refused excluded paths, including './' spellings.")
+        else:
+            print(f"FAILURE: GETB served excluded entries {[header for header, _ in entries]}.")
+    finally:
+        server.stop_server()
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+def test_file_writer():
+    print("Testing download writer verification...")
+    base_dir = tempfile.mkdtemp(prefix="sum_writer_")
+    data = os.urandom(300000)
+    expected_hash = hashlib.md5(data).hexdigest()
+
+    good_path = os.path.join(base_dir, "nested", "good.bin")
+    writer = FileWriter(good_path, size=len(data) + 4096, expected_hash=expected_hash, buffer_size=65536)
+    for offset in range(0, len(data), 8192):
+        writer.write(data[offset:offset + 8192])
+    if not writer.finish():
+        print("FAILURE: Valid download failed verification.")
+    else:
+        with open(good_path, "rb") as f:
+            if f.read() == data:
+                print("SUCCESS: Verified file written and preallocation trimmed.")
+            else:
+                print("FAILURE: Written file does not match the received data.")
+
+    # Failed downloads must leave the previous copy in place
+    previous = b"previous version"
+    bad_path = os.path.join(base_dir, "bad.bin")
+    with open(bad_path, "wb") as f:
+        f.write(previous)
+    writer = FileWriter(bad_path, size=len(data), expected_hash=expected_hash)
+    writer.write(data[:-1] + b"x")
+    with open(bad_path, "rb") as f:
+        kept = f.read()
+    if not writer.finish() and kept == previous:
+        print("SUCCESS: Hash mismatch detected and previous copy kept.")
+    else:
+        print("FAILURE: Corrupt download replaced the previous copy.")
+
+    aborted_path = os.path.join(base_dir, "aborted.bin")
+    writer = FileWriter(aborted_path, size=len(data), expected_hash=expected_hash)
+    writer.write(data[:1000])
+    writer.abort()
+    if not os.path.exists(aborted_path):
+        print("SUCCESS: Aborted download left no partial file.")
+    else:
+        print("FAILURE: Aborted download left a partial file.")
+
+    leftovers = [name for name in os.listdir(base_dir) if name.endswith(".part")]
+    if leftovers:
+        print(f"FAILURE: Temporary files left behind: {leftovers}")
+    shutil.rmtree(base_dir, ignore_errors=True)
+
+def test_nested_sync():
+    print("Testing manifest index descent on a nested tree...")
+    base_dir = tempfile.mkdtemp(prefix="sum_tree_")
+    server_dir = os.path.join(base_dir, "server")
+    client_dir = os.path.join(base_dir, "client")
+    for a in range(4):
+        for b in range(4):
+            folder = os.path.join(server_dir, f"area{a}", f"block{b}", "deep")
+            os.makedirs(folder)
+            for i in range(3):
+                with open(os.path.join(folder, f"file{i}.txt"), "w") as f:
+                    f.write(f"{a}-{b}-{i}")
+
+    server = start_test_server(server_dir, 5004)
+    client = make_test_client(client_dir, 5004)
+    found = []
+    client.log_message.connect(lambda msg: found.append(msg) if msg.startswith("Found") or "up to date" in msg else None)
+    try:
+        client.running = True
+        client._sync_process()
+
+        # Change one deep file and wait for the server's watcher to rescan
+        changed = os.path.join("area2", "block1", "deep", "file0.txt")
+        with open(os.path.join(server_dir, changed), "w") as f:
+            f.write("changed")
+        time.sleep(1.5)
+        client.running = True
+        client._sync_process()
+        client.running = True
+        client._sync_process()
+    finally:
+        server.stop_server()
+
+    with open(os.path.join(client_dir, changed)) as f:
+        content = f.read()
+    expected = ["Found 48 new/modified files.", "Found 1 new/modified files.", "Folder is up to date."]
+    if found == expected and content == "changed":
+        print("SUCCESS: Nested tree synced and only the changed file was fetched again.")
+    else:
+        print(f"FAILURE: Unexpected sync results {found}, content '{content}'")
+    shutil.rmtree(base_dir, ignore_errors=True)
+
 if __name__ == "__main__":
+    from PySide6.QtCore import QCoreApplication
+    app = QCoreApplication([])
+
     test_sync()
+    test_session()
+    test_file_cache()
+    test_bundle_reader()
+    test_bundle_sync()
+    test_sync_rules()
+    test_excluded_requests()
+    test_file_writer()
+    test_nested_sync()